@@ -1,16 +1,63 @@
 # app.py
-import uuid
+import asyncio
+import logging
+import logging.handlers
+import os
+import queue
 import time
-import threading
+from contextlib import asynccontextmanager
+import msgspec
 from fastapi import FastAPI, Request
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import FileResponse, JSONResponse
+from fastapi.responses import FileResponse, ORJSONResponse
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
-from typing import Dict, Optional
-from chat_bienestar import ChatBienestar
+from typing import Optional, Tuple
+from chat_bienestar import MSG_BIENVENIDA, abrir_cliente_http, cerrar_cliente_http, estadisticas_cache_api, procesar_mensaje as procesar_mensaje_chat
+from sesiones import REDIS_URL, crear_almacen
 
-app = FastAPI()
+logger = logging.getLogger(__name__)
+LOG_LEVEL = os.environ.get("LOG_LEVEL", "INFO").upper()
+
+def _iniciar_logging() -> Tuple[logging.Handler, logging.handlers.QueueListener]:
+    """
+    Los handlers del root sólo encolan el registro; la escritura a stderr la
+    hace el hilo del QueueListener, así el event loop nunca espera por I/O de logs.
+    """
+    cola: queue.SimpleQueue = queue.SimpleQueue()
+    salida = logging.StreamHandler()
+    salida.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s: %(message)s"))
+    raiz = logging.getLogger()
+    encolador = logging.handlers.QueueHandler(cola)
+    raiz.addHandler(encolador)
+    raiz.setLevel(LOG_LEVEL)
+    # httpx registra cada petición en INFO; una línea por llamada a la API es demasiado ruido
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+    listener = logging.handlers.QueueListener(cola, salida, respect_handler_level=True)
+    listener.start()
+    return encolador, listener
+
+def _detener_logging(encolador: logging.Handler, listener: logging.handlers.QueueListener) -> None:
+    """Quita el handler del root antes de parar el listener, que vacía lo que quedó en la cola."""
+    logging.getLogger().removeHandler(encolador)
+    listener.stop()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Abre el logging, el cliente HTTP y la purga periódica al arrancar; los cierra al apagar."""
+    log_handler, log_listener = _iniciar_logging()
+    await abrir_cliente_http()
+    purge_task = asyncio.create_task(_purge_loop())
+    yield
+    purge_task.cancel()
+    try:
+        await purge_task
+    except asyncio.CancelledError:
+        pass
+    await sesiones.cerrar()
+    await cerrar_cliente_http()
+    _detener_logging(log_handler, log_listener)
+
+app = FastAPI(lifespan=lifespan, default_response_class=ORJSONResponse)
 
 # Configurar CORS para permitir solicitudes desde cualquier origen
 app.add_middleware(
@@ -28,111 +75,147 @@ app.mount("/static", StaticFiles(directory="static"), name="static")
 def index():
     return FileResponse("static/index.html")
 
-# Modelo para recibir mensaje
-class Mensaje(BaseModel):
-    session_id: Optional[str] = None
+# Modelo para recibir mensaje; se decodifica con msgspec directamente del body
+class Mensaje(msgspec.Struct):
     mensaje: str
+    session_id: Optional[str] = None
 
-# Session store en memoria
-sessions: Dict[str, Dict] = {}
-SESSION_TIMEOUT_SECONDS = 20 * 60  # 20 minutos
-lock = threading.Lock()
+    def __post_init__(self):
+        # Se normaliza una sola vez al decodificar; ChatBienestar lo recibe ya limpio
+        self.mensaje = self.mensaje.strip().lower()
 
-def purge_expired_sessions():
-    """Elimina sesiones inactivas."""
-    now = time.time()
-    with lock:
-        expired = [sid for sid, v in sessions.items() 
-                  if now - v["last_active"] > SESSION_TIMEOUT_SECONDS]
-        for sid in expired:
-            del sessions[sid]
-            print(f"Sesión expirada eliminada: {sid}")
+_decoder_mensaje = msgspec.json.Decoder(Mensaje)
+
+class CerrarSesion(msgspec.Struct):
+    session_id: str
+
+_decoder_cerrar = msgspec.json.Decoder(CerrarSesion)
+
+def fast_sid() -> str:
+    """Genera un session_id con formato UUID4 sin construir un objeto uuid.UUID."""
+    b = bytearray(os.urandom(16))
+    b[6] = (b[6] & 0x0F) | 0x40  # versión 4
+    b[8] = (b[8] & 0x3F) | 0x80  # variante RFC 4122
+    h = b.hex()
+    return f"{h[:8]}-{h[8:12]}-{h[12:16]}-{h[16:20]}-{h[20:]}"
+
+# Session store: Redis si hay REDIS_URL, si no memoria del proceso
+sesiones = crear_almacen()
+PURGE_INTERVAL_SECONDS = 30
 
+async def _purge_loop():
+    """Purga las sesiones expiradas cada PURGE_INTERVAL_SECONDS, fuera del camino de las peticiones."""
+    while True:
+        await asyncio.sleep(PURGE_INTERVAL_SECONDS)
+        try:
+            sesiones.purgar()
+        except Exception as e:
+            logger.exception("Error purgando sesiones: %s", e)
+
+# Las rutas del chat devuelven ORJSONResponse ya construida: si devuelven un dict,
+# FastAPI lo recorre con jsonable_encoder antes de serializarlo
 @app.post("/mensajear")
-def procesar_mensaje(data: Mensaje):
+async def procesar_mensaje(request: Request):
+    try:
+        data = _decoder_mensaje.decode(await request.body())
+    except msgspec.DecodeError as e:
+        return ORJSONResponse(status_code=422, content={"detail": str(e)})
+
     try:
-        purge_expired_sessions()  # limpieza ligera en cada petición
-        
         sid = data.session_id
         if not sid:
             # generar nueva sesión
-            sid = str(uuid.uuid4())
-            with lock:
-                sessions[sid] = {
-                    "chat": ChatBienestar(), 
-                    "last_active": time.time()
-                }
-            return JSONResponse(content={
+            sid = fast_sid()
+            await sesiones.crear(sid)
+            return ORJSONResponse({
                 "session_id": sid, 
-                "respuesta": "¡Hola! 👋 Bienvenido a Yo Soy Bienestar.\n\nPor favor comparte tu número telefónico para verificar que eres cliente Yo Soy Bienestar."
+                "respuesta": MSG_BIENVENIDA
             })
 
-        with lock:
-            session = sessions.get(sid)
-            if not session:
+        # Mensajes de la misma sesión se procesan de uno en uno (p. ej. doble envío);
+        # sesiones distintas no comparten lock y siguen en paralelo
+        async with sesiones.candado(sid):
+            sesion = await sesiones.obtener(sid)
+            if sesion is None:
                 # Sesión no encontrada, crear nueva
-                sessions[sid] = {
-                    "chat": ChatBienestar(), 
-                    "last_active": time.time()
-                }
-                session = sessions[sid]
-                respuesta = "¡Hola! 👋 Bienvenido a Yo Soy Bienestar.\n\nPor favor comparte tu número telefónico para verificar que eres cliente Yo Soy Bienestar."
+                await sesiones.crear(sid)
+                respuesta = MSG_BIENVENIDA
             else:
-                session["last_active"] = time.time()
-                chatbot: ChatBienestar = session["chat"]
-                respuesta = chatbot.procesar_mensaje(data.mensaje)
+                respuesta = await procesar_mensaje_chat(sesion, data.mensaje)
+                await sesiones.guardar(sid, sesion)
 
-        return JSONResponse(content={
+        return ORJSONResponse({
             "session_id": sid, 
             "respuesta": respuesta
         })
     except Exception as e:
-        print(f"Error procesando mensaje: {e}")
-        return JSONResponse(
+        logger.exception("Error procesando mensaje: %s", e)
+        return ORJSONResponse(
             status_code=500, 
             content={"error": str(e), "session_id": sid if 'sid' in locals() else None}
         )
 
 @app.get("/nueva_sesion")
-def nueva_sesion():
+async def nueva_sesion():
     """Crea una nueva sesión de chat"""
-    sid = str(uuid.uuid4())
-    with lock:
-        sessions[sid] = {
-            "chat": ChatBienestar(), 
-            "last_active": time.time()
-        }
+    sid = fast_sid()
+    await sesiones.crear(sid)
     
-    return JSONResponse(content={
+    return ORJSONResponse({
         "session_id": sid,
-        "respuesta": "¡Hola! 👋 Bienvenido a Yo Soy Bienestar.\n\nPor favor comparte tu número telefónico para verificar que eres cliente Yo Soy Bienestar."
+        "respuesta": MSG_BIENVENIDA
     })
 
+@app.post("/cerrar_sesion")
+async def cerrar_sesion(request: Request):
+    """Elimina una sesión antes de que expire"""
+    try:
+        data = _decoder_cerrar.decode(await request.body())
+    except msgspec.DecodeError as e:
+        return ORJSONResponse(status_code=422, content={"detail": str(e)})
+
+    cerrada = await sesiones.eliminar(data.session_id)
+    return {"session_id": data.session_id, "cerrada": cerrada}
+
 @app.get("/health")
-def health():
-    with lock:
-        active_sessions = len(sessions)
-    return {
-        "status": "ok", 
-        "active_sessions": active_sessions,
-        "timestamp": time.time()
-    }
+async def health():
+    estado = {"status": "ok"}
+    # Con Redis no se cuentan las sesiones (contar() devuelve None)
+    active_sessions = await sesiones.contar()
+    if active_sessions is not None:
+        estado["active_sessions"] = active_sessions
+    estado["timestamp"] = time.time()
+    return estado
+
+@app.get("/cache_stats")
+async def cache_stats():
+    """Aciertos, fallos y desalojos de la caché de respuestas de la API"""
+    return estadisticas_cache_api()
 
 @app.get("/debug_sessions")
-def debug_sessions():
+async def debug_sessions():
     """Endpoint para debugging (no usar en producción)"""
-    with lock:
-        session_info = {
-            sid: {
-                "last_active": time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(data["last_active"])),
-                "estado_actual": data["chat"].estado,
-                "numero_verificado": data["chat"].numero_verificado,
-                "inactivo_segundos": time.time() - data["last_active"]
-            }
-            for sid, data in sessions.items()
+    now = time.time()
+    session_info = {
+        sid: {
+            "last_active": time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(data["last_active"])),
+            "estado_actual": data["estado_actual"],
+            "numero_verificado": data["numero_verificado"],
+            "inactivo_segundos": now - data["last_active"]
         }
-    return JSONResponse(content=session_info)
+        for sid, data in (await sesiones.describir()).items()
+    }
+    return session_info
 
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8000)
\ No newline at end of file
+    # Con sesiones en memoria cada worker tendría las suyas; varios workers sólo con Redis
+    uvicorn.run(
+        "app:app",
+        host="0.0.0.0",
+        port=8000,
+        workers=(os.cpu_count() or 1) if REDIS_URL else 1,
+        loop="uvloop",
+        http="httptools",
+        log_level="warning",
+    )
\ No newline at end of file
@@ -5,242 +5,515 @@ Módulo de verificación de clientes y consulta de recargas
 (versión lista para importar)
 """
 
-import requests
+import asyncio
+import ciso8601
+import httpx
+import logging
+import orjson
+import random
 import re
-from typing import Dict, List, Optional, Union, Tuple
+import time
+from collections import OrderedDict, deque
+from dataclasses import dataclass
+from enum import IntEnum
+from functools import lru_cache
+from types import MappingProxyType
+from typing import Any, Callable, Dict, List, Optional, Union, Tuple
 from datetime import datetime
 
-class ChatBienestar:
-    TIMEOUT_API = 60  # segundos
-    ESTADOS = {
-        "INICIO": "inicio",
-        "SOLICITAR_NUMERO": "solicitar_numero",
-        "MENU_PRINCIPAL": "menu_principal",
-        "SOLICITAR_REFERENCIA": "solicitar_referencia",
-        "FINALIZADO": "finalizado"
-    }
-
-    def __init__(self) -> None:
-        self.base_url = "https://recargasyventassims.yosoybienestar.com/YSB"
-        self.estado = self.ESTADOS["INICIO"]
+logger = logging.getLogger(__name__)
+
+
+class Estado(IntEnum):
+    """Estados de la conversación; el valor indexa la tabla de manejadores."""
+    INICIO = 0
+    SOLICITAR_NUMERO = 1
+    MENU_PRINCIPAL = 2
+    SOLICITAR_REFERENCIA = 3
+    FINALIZADO = 4
+
+
+_NO_DIGITOS = re.compile(r'\D+')
+_PALABRAS = re.compile(r'\w+')
+
+# Palabras que abren la conversación; se comparan por palabra completa, no como subcadena
+_SALUDOS = frozenset({"hola", "buenas", "hi", "hello", "hey"})
+
+# Sustituto de sólo lectura para objetos ausentes en la respuesta de la API
+_VACIO = MappingProxyType({})
+
+# Respuestas fijas del chat: se construyen una vez y se devuelven tal cual
+MSG_BIENVENIDA = (
+    "¡Hola! 👋 Bienvenido a Yo Soy Bienestar.\n\n"
+    "Por favor comparte tu número telefónico para verificar que eres cliente Yo Soy Bienestar."
+)
+_MSG_SALUDO_REQUERIDO = "Por favor inicia la conversación con 'Hola'"
+_MSG_NUMERO_INVALIDO = "⚠️ Por favor ingresa un número telefónico válido de 10 dígitos."
+_MSG_NO_CLIENTE = "❌ No eres cliente, no podemos hacer más. Gracias por contactarnos. 👋"
+_MSG_REFERENCIA_INVALIDA = "⚠️ Por favor ingresa un número de referencia válido."
+_MSG_FINALIZADO = "La conversación ha finalizado. Si necesitas ayuda, por favor inicia una nueva conversación."
+_MSG_TIMEOUT = (
+    "❌ ⏱️ La verificación está tomando más tiempo de lo esperado. "
+    "Por favor intenta nuevamente más tarde."
+)
+_MSG_TIMEOUT_RECARGA = (
+    "❌ ⏱️ La verificación de la recarga está tomando más tiempo de lo esperado. "
+    "Por favor intenta nuevamente más tarde o contacta a soporte."
+)
+_MSG_OPCION_INVALIDA = (
+    "⚠️ Opción no válida. Por favor selecciona:\n\n"
+    "1️⃣ Reportar problema con recarga\n"
+    "2️⃣ Realizar otro tipo de reporte\n"  
+    "3️⃣ Salir del chat\n\n"
+    "Escribe 1, 2 o 3:"
+)
+
+# Opción del menú principal -> (respuesta, siguiente estado)
+_OPCIONES_MENU: Dict[str, Tuple[str, Estado]] = {
+    "1": (
+        "📋 Reportar Problema con Recarga\n\n"
+        "Por favor ingresa el número de referencia de tu recarga:",
+        Estado.SOLICITAR_REFERENCIA,
+    ),
+    "2": (
+        "ℹ️ Realizar otro tipo de reporte\n\n"
+        "Esta funcionalidad actualmente no está desarrollada ni implementada.\n\n"
+        "Gracias por contactarnos. 👋",
+        Estado.FINALIZADO,
+    ),
+    "3": (
+        "👋 ¡Gracias por usar nuestro servicio! Que tengas un excelente día.",
+        Estado.FINALIZADO,
+    ),
+}
+
+_PLANTILLA_VERIFICACION = """✅ ¡Verificación exitosa! 
+
+Hola bienvenido Cliente Yo Soy Bienestar.
+
+📱 Número: {msisdn}
+⚡ Servicio: {altanService}
+🟢 Estado: {altanStatus}
+
+¿Qué operación deseas realizar?
+
+1️⃣ Reportar problema con recarga
+2️⃣ Realizar otro tipo de reporte  
+3️⃣ Salir del chat
+
+Por favor selecciona una opción (1, 2 o 3):"""
+
+
+class _ConDefecto(dict):
+    """Dict para format_map que muestra 'N/A' en los campos que faltan."""
+
+    def __missing__(self, clave: str) -> str:
+        return "N/A"
+
+
+# Campos de fecha de una recarga, en el orden en que se muestran
+_CAMPOS_FECHA = ("creationDate", "operationDate", "dueDate")
+
+# Estado de la recarga en la API -> (emoji, texto mostrado al cliente)
+_ESTADOS_RECARGA: Dict[str, Tuple[str, str]] = {
+    "completed": ("✅", "Completado"),
+    "pending": ("⏳", "Pendiente"),
+    "failed": ("❌", "Fallido"),
+    "cancelled": ("❌", "Cancelado"),
+    "in_progress": ("⏳", "En Progreso")
+}
+
+
+@lru_cache(maxsize=512)
+def _formatear_fecha_iso(fecha_str: str) -> str:
+    """Convierte una fecha de la API a dd/mm/aaaa hh:mm:ss; las consultas repetidas salen de la caché."""
+    try:
+        # ciso8601 acepta 'T' o espacio como separador y la zona 'Z' directamente
+        fecha_obj = ciso8601.parse_datetime(fecha_str)
+    except ValueError:
+        try:
+            fecha_obj = datetime.strptime(fecha_str, '%Y-%m-%d %H:%M:%S')
+        except ValueError:
+            return "N/A"
+    return fecha_obj.strftime('%d/%m/%Y %H:%M:%S')
+
+_PLANTILLA_RECARGA = """✅ **Información de Recarga Encontrada**
+
+📊 **Referencia:** {referencia}
+👤 **Cliente:** {cliente}
+📱 **Teléfono:** {telefono}
+💰 **Monto:** ${monto} MXN
+{emoji_estado} **Estado:** {estado}
+🔢 **Autorización:** {autorizacion}
+
+📅 **Fechas:**
+   • Creación: {fecha_creacion}
+   • Operación: {fecha_operacion}
+   • Vencimiento: {fecha_vencimiento}
+
+📋 **Descripción:** {descripcion}
+
+¡Gracias por ser parte de Yo Soy Bienestar! 👋"""
+
+
+class _CacheTTL:
+    """LRU acotado cuyas entradas expiran `ttl` segundos después de guardarse."""
+
+    def __init__(self, maxsize: int, ttl: float) -> None:
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._datos: OrderedDict = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, clave: Tuple[str, str]) -> Any:
+        item = self._datos.get(clave)
+        if item is None:
+            self.misses += 1
+            return None
+        expira, valor = item
+        if expira < time.monotonic():
+            del self._datos[clave]
+            self.misses += 1
+            return None
+        self._datos.move_to_end(clave)
+        self.hits += 1
+        return valor
+
+    def set(self, clave: Tuple[str, str], valor: Any, ttl: Optional[float] = None) -> None:
+        self._datos[clave] = (time.monotonic() + (self.ttl if ttl is None else ttl), valor)
+        self._datos.move_to_end(clave)
+        while len(self._datos) > self.maxsize:
+            self._datos.popitem(last=False)
+            self.evictions += 1
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "size": len(self._datos),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions
+        }
+
+
+# Respuestas recientes de la API, compartidas entre sesiones. Sólo se usa desde
+# el event loop y sin awaits intermedios, por lo que no necesita lock.
+_cache_api = _CacheTTL(maxsize=4096, ttl=60)
+# Las respuestas vacías (no encontrado) se guardan poco tiempo para no envenenar la caché
+TTL_CACHE_NEGATIVO = 5
+
+
+def estadisticas_cache_api() -> Dict[str, int]:
+    """Contadores de la caché de respuestas de la API."""
+    return _cache_api.stats()
+
+
+class _CircuitoAPI:
+    """
+    Circuit breaker de la API: si más de `umbral` de las últimas `ventana`
+    llamadas fallaron, deja de llamarla durante `pausa` segundos.
+    """
+
+    def __init__(self, ventana: int, umbral: float, pausa: float) -> None:
+        self._resultados: deque = deque(maxlen=ventana)
+        self.umbral = umbral
+        self.pausa = pausa
+        self._abierto_hasta = 0.0
+
+    def permite(self) -> bool:
+        return time.monotonic() >= self._abierto_hasta
+
+    def registrar(self, exito: bool) -> None:
+        self._resultados.append(exito)
+        if (len(self._resultados) == self._resultados.maxlen
+                and self._resultados.count(False) > self.umbral * len(self._resultados)):
+            self._abierto_hasta = time.monotonic() + self.pausa
+            self._resultados.clear()
+
+
+_circuito_api = _CircuitoAPI(ventana=20, umbral=0.5, pausa=10.0)
+
+# Cliente HTTP compartido por todas las sesiones; se abre y cierra en el lifespan de la app.
+# Mantiene un pool de conexiones keep-alive hacia la API para no repetir el handshake TLS.
+_cliente_http: Optional[httpx.AsyncClient] = None
+MAX_CONEXIONES_API = 100
+MAX_CONEXIONES_KEEPALIVE = 50
+EXPIRACION_KEEPALIVE = 30  # segundos que una conexión ociosa sigue abierta
+# Un reintento, con backoff exponencial + jitter, sólo si falla el establecimiento de la conexión
+REINTENTOS_CONEXION = 1
+BACKOFF_BASE = 0.1  # segundos
+# Máximo de consultas simultáneas a la API, para protegerla en picos de tráfico.
+# El semáforo se crea junto al cliente: queda ligado al event loop que lo usa primero.
+MAX_CONSULTAS_SIMULTANEAS = 32
+_SEMAFORO_API: Optional[asyncio.Semaphore] = None
+# URL -> tarea de la consulta en curso, para no duplicar peticiones idénticas
+_peticiones_en_curso: Dict[str, "asyncio.Task"] = {}
+
+
+async def abrir_cliente_http() -> None:
+    """Crea el cliente HTTP asíncrono usado para consultar la API."""
+    global _cliente_http, _SEMAFORO_API
+    if _cliente_http is None:
+        _SEMAFORO_API = asyncio.Semaphore(MAX_CONSULTAS_SIMULTANEAS)
+        # Con un transport explícito httpx ignora limits/http2 del cliente,
+        # así que se configuran en el transport
+        _cliente_http = httpx.AsyncClient(
+            timeout=ChatBienestar.TIMEOUT_API,
+            transport=httpx.AsyncHTTPTransport(
+                http2=True,
+                limits=httpx.Limits(
+                    max_connections=MAX_CONEXIONES_API,
+                    max_keepalive_connections=MAX_CONEXIONES_KEEPALIVE,
+                    keepalive_expiry=EXPIRACION_KEEPALIVE,
+                ),
+            ),
+        )
+
+
+async def cerrar_cliente_http() -> None:
+    """Cierra el cliente HTTP y libera sus conexiones."""
+    global _cliente_http, _SEMAFORO_API
+    if _cliente_http is not None:
+        await _cliente_http.aclose()
+        _cliente_http = None
+        _SEMAFORO_API = None
+
+
+@dataclass(slots=True)
+class SesionChat:
+    """Estado de una conversación; es lo único que se guarda por sesión."""
+    estado: Estado = Estado.INICIO
+    numero_verificado: Optional[str] = None
+    datos_cliente: Optional[Dict] = None
+
+    def reset(self) -> None:
+        """Regresa la sesión al estado inicial para reutilizar la instancia."""
+        self.estado = Estado.INICIO
         self.numero_verificado = None
         self.datos_cliente = None
 
+    @property
+    def nombre_estado(self) -> str:
+        return self.estado.name.lower()
+
+    def dump(self) -> Dict[str, Any]:
+        """Estado de la conversación como tipos simples, para serializarlo fuera del proceso."""
+        return {
+            "estado": int(self.estado),
+            "numero_verificado": self.numero_verificado,
+            "datos_cliente": self.datos_cliente
+        }
+
+    @classmethod
+    def restore(cls, datos: Dict[str, Any]) -> "SesionChat":
+        """Reconstruye una sesión a partir de lo producido por dump()."""
+        return cls(
+            estado=Estado(datos.get("estado", Estado.INICIO)),
+            numero_verificado=datos.get("numero_verificado"),
+            datos_cliente=datos.get("datos_cliente")
+        )
+
+
+class ChatBienestar:
+    """
+    Lógica del chat sin estado propio: cada método recibe la SesionChat que
+    modifica, así una sola instancia atiende a todas las conversaciones.
+    Sin __dict__ (slots vacíos): asignar estado a la instancia compartida falla
+    con AttributeError en lugar de mezclar conversaciones en silencio.
+    """
+    __slots__ = ()
+
+    # Tiempos cortos por fase: una API colgada no debe retener la petición un minuto
+    TIMEOUT_API = httpx.Timeout(connect=3.0, read=8.0, write=3.0, pool=1.0)
+    base_url = "https://recargasyventassims.yosoybienestar.com/YSB"
+
     def validar_numero_telefonico(self, numero: str) -> Tuple[bool, Optional[str]]:
-        numero_limpio = re.sub(r'[^\d]', '', numero)
-        if len(numero_limpio) == 10 and numero_limpio.isdigit():
+        # Camino rápido: el número ya viene sin separadores (isdecimal equivale a \d)
+        if len(numero) == 10 and numero.isdecimal():
+            return True, numero
+        numero_limpio = _NO_DIGITOS.sub('', numero)
+        # Tras quitar todo lo que no es dígito basta con revisar la longitud
+        if len(numero_limpio) == 10:
             return True, numero_limpio
         return False, None
 
-    def _realizar_peticion_api(self, url: str) -> Union[Dict, str, None]:
+    async def _realizar_peticion_api(self, url: str) -> Union[Dict, str, None]:
+        # Peticiones simultáneas a la misma URL comparten una sola llamada. Se espera
+        # con shield para que cancelar a un solicitante no cancele a los demás.
+        tarea = _peticiones_en_curso.get(url)
+        if tarea is None:
+            tarea = asyncio.ensure_future(self._peticion_http(url))
+            _peticiones_en_curso[url] = tarea
+            tarea.add_done_callback(lambda _: _peticiones_en_curso.pop(url, None))
+        return await asyncio.shield(tarea)
+
+    async def _peticion_http(self, url: str) -> Union[Dict, str, None]:
+        if _cliente_http is None:
+            raise RuntimeError("El cliente HTTP no ha sido inicializado (abrir_cliente_http)")
+        if not _circuito_api.permite():
+            # La API viene fallando; se responde como timeout sin llamarla
+            return "timeout"
         try:
-            respuesta = requests.get(url, timeout=self.TIMEOUT_API)
-            if respuesta.status_code == 200:
-                datos = respuesta.json()
-                return datos if datos else {}
-            else:
+            codigo, cuerpo = await self._get_con_reintento(url)
+            _circuito_api.registrar(codigo < 500)
+            # Sólo un 404 o un 200 vacío significan "no encontrado" ({}, se cachea);
+            # cualquier otro error devuelve None, que no se guarda en la caché
+            if codigo == 404:
                 return {}
-        except requests.exceptions.Timeout:
+            if cuerpo is None:
+                return None
+            datos = orjson.loads(cuerpo)
+            return datos if datos else {}
+        except httpx.TimeoutException:
+            _circuito_api.registrar(False)
             return "timeout"
-        except requests.exceptions.RequestException as error:
-            print(f"Error de conexión con la API: {error}")
-            return {}
+        except httpx.HTTPError as error:
+            _circuito_api.registrar(False)
+            logger.warning("Error de conexión con la API: %s", error)
+            return None
         except Exception as error:
-            print(f"Error inesperado en petición API: {error}")
-            return {}
-
-    def verificar_cliente_api(self, numero: str) -> Union[List[Dict], str, None]:
+            logger.exception("Error inesperado en petición API: %s", error)
+            return None
+
+    async def _get_con_reintento(self, url: str) -> Tuple[int, Optional[bytes]]:
+        """Devuelve (código HTTP, cuerpo); el cuerpo es None si la respuesta no es 200."""
+        for intento in range(REINTENTOS_CONEXION + 1):
+            try:
+                async with _SEMAFORO_API:
+                    async with _cliente_http.stream("GET", url) as respuesta:
+                        if respuesta.status_code != 200 and respuesta.http_version == "HTTP/2":
+                            # En HTTP/2 cerrar sin leer sólo reinicia el stream; el error no se descarga
+                            return respuesta.status_code, None
+                        # En HTTP/1.1 se lee siempre: una respuesta sin consumir cierra la
+                        # conexión en vez de devolverla al pool
+                        cuerpo = await respuesta.aread()
+                        return respuesta.status_code, cuerpo if respuesta.status_code == 200 else None
+            except httpx.ConnectError:
+                if intento == REINTENTOS_CONEXION:
+                    raise
+            # Se espera fuera del semáforo para no ocupar un lugar durante el backoff
+            await asyncio.sleep(BACKOFF_BASE * 2 ** intento + random.uniform(0, BACKOFF_BASE))
+
+    async def _consultar_con_cache(self, clave: Tuple[str, str], url: str) -> Union[Dict, List[Dict], str, None]:
+        resultado = _cache_api.get(clave)
+        if resultado is not None:
+            return resultado
+        resultado = await self._realizar_peticion_api(url)
+        # Los timeouts nunca se guardan; las respuestas vacías, sólo unos segundos
+        if resultado == "timeout" or resultado is None:
+            return resultado
+        _cache_api.set(clave, resultado, None if resultado else TTL_CACHE_NEGATIVO)
+        return resultado
+
+    async def verificar_cliente_api(self, numero: str) -> Union[List[Dict], str, None]:
         url = f"{self.base_url}/sim/{numero}/msisdn"
-        return self._realizar_peticion_api(url)
+        return await self._consultar_con_cache(("sim", numero), url)
 
-    def verificar_recarga_api(self, referencia: str) -> Union[Dict, str, None]:
+    async def verificar_recarga_api(self, referencia: str) -> Union[Dict, str, None]:
         url = f"{self.base_url}/payment/{referencia}"
-        return self._realizar_peticion_api(url)
+        return await self._consultar_con_cache(("pay", referencia), url)
 
     # --- lógica de estados (igual a la tuya) ---
-    def _procesar_estado_inicio(self, mensaje: str) -> str:
-        if "hola" in mensaje:
-            self.estado = self.ESTADOS["SOLICITAR_NUMERO"]
-            return self._mensaje_bienvenida()
+    async def _procesar_estado_inicio(self, sesion: SesionChat, mensaje: str) -> str:
+        if not _SALUDOS.isdisjoint(_PALABRAS.findall(mensaje)):
+            sesion.estado = Estado.SOLICITAR_NUMERO
+            return MSG_BIENVENIDA
         else:
-            return "Por favor inicia la conversación con 'Hola'"
+            return _MSG_SALUDO_REQUERIDO
 
-    def _procesar_estado_solicitar_numero(self, mensaje: str) -> str:
+    async def _procesar_estado_solicitar_numero(self, sesion: SesionChat, mensaje: str) -> str:
         es_valido, numero_limpio = self.validar_numero_telefonico(mensaje)
         if not es_valido:
-            return "⚠️ Por favor ingresa un número telefónico válido de 10 dígitos."
+            return _MSG_NUMERO_INVALIDO
 
-        print("⏳ Verificando número en la API...")
-        resultado_api = self.verificar_cliente_api(numero_limpio)
+        logger.debug("Verificando número en la API")
+        resultado_api = await self.verificar_cliente_api(numero_limpio)
         if resultado_api == "timeout":
-            self.estado = self.ESTADOS["FINALIZADO"]
-            return self._mensaje_timeout()
+            sesion.estado = Estado.FINALIZADO
+            return _MSG_TIMEOUT
         if resultado_api:
-            self.datos_cliente = resultado_api[0] if isinstance(resultado_api, list) else resultado_api
-            self.numero_verificado = numero_limpio
-            self.estado = self.ESTADOS["MENU_PRINCIPAL"]
-            return self._mensaje_verificacion_exitosa()
+            sesion.datos_cliente = resultado_api[0] if isinstance(resultado_api, list) else resultado_api
+            sesion.numero_verificado = numero_limpio
+            sesion.estado = Estado.MENU_PRINCIPAL
+            return self._mensaje_verificacion_exitosa(sesion.datos_cliente)
         else:
-            self.estado = self.ESTADOS["FINALIZADO"]
-            return "❌ No eres cliente, no podemos hacer más. Gracias por contactarnos. 👋"
-
-    def _procesar_estado_menu_principal(self, mensaje: str) -> str:
-        opciones = {
-            "1": self._manejar_opcion_recarga,
-            "2": self._manejar_opcion_otro_reporte,
-            "3": self._manejar_opcion_salir
-        }
-        manejador = opciones.get(mensaje, self._manejar_opcion_invalida)
-        return manejador()
+            sesion.estado = Estado.FINALIZADO
+            return _MSG_NO_CLIENTE
+
+    async def _procesar_estado_menu_principal(self, sesion: SesionChat, mensaje: str) -> str:
+        opcion = _OPCIONES_MENU.get(mensaje)
+        if opcion is None:
+            return _MSG_OPCION_INVALIDA
+        respuesta, sesion.estado = opcion
+        return respuesta
 
-    def _procesar_estado_solicitar_referencia(self, mensaje: str) -> str:
+    async def _procesar_estado_solicitar_referencia(self, sesion: SesionChat, mensaje: str) -> str:
         referencia = mensaje.strip()
         if not referencia:
-            return "⚠️ Por favor ingresa un número de referencia válido."
+            return _MSG_REFERENCIA_INVALIDA
 
-        print("⏳ Verificando recarga en la API...")
-        resultado_recarga = self.verificar_recarga_api(referencia)
+        logger.debug("Verificando recarga en la API")
+        resultado_recarga = await self.verificar_recarga_api(referencia)
         if resultado_recarga == "timeout":
-            self.estado = self.ESTADOS["FINALIZADO"]
-            return self._mensaje_timeout_recarga()
+            sesion.estado = Estado.FINALIZADO
+            return _MSG_TIMEOUT_RECARGA
         if resultado_recarga and resultado_recarga.get("code") == 0:
-            self.estado = self.ESTADOS["FINALIZADO"]
+            sesion.estado = Estado.FINALIZADO
             return self._formatear_informacion_recarga(resultado_recarga, referencia)
         else:
-            self.estado = self.ESTADOS["FINALIZADO"]
+            sesion.estado = Estado.FINALIZADO
             return self._mensaje_referencia_no_encontrada(referencia)
 
-    def procesar_mensaje(self, mensaje: str) -> str:
-        mensaje_limpio = mensaje.strip().lower()
-        manejadores_estado = {
-            self.ESTADOS["INICIO"]: self._procesar_estado_inicio,
-            self.ESTADOS["SOLICITAR_NUMERO"]: self._procesar_estado_solicitar_numero,
-            self.ESTADOS["MENU_PRINCIPAL"]: self._procesar_estado_menu_principal,
-            self.ESTADOS["SOLICITAR_REFERENCIA"]: self._procesar_estado_solicitar_referencia
-        }
-        if self.estado == self.ESTADOS["FINALIZADO"]:
-            return "La conversación ha finalizado. Si necesitas ayuda, por favor inicia una nueva conversación."
-
-        manejador = manejadores_estado.get(self.estado)
-        return manejador(mensaje_limpio) if manejador else "Estado no válido"
+    # Tabla de despacho indexada por Estado, construida una sola vez al definir la clase
+    _MANEJADORES_ESTADO: Tuple[Optional[Callable], ...] = (
+        _procesar_estado_inicio,
+        _procesar_estado_solicitar_numero,
+        _procesar_estado_menu_principal,
+        _procesar_estado_solicitar_referencia,
+        None  # FINALIZADO
+    )
+
+    async def procesar_mensaje(self, sesion: SesionChat, mensaje: str) -> str:
+        # `mensaje` llega ya normalizado (strip + lower) desde el modelo Mensaje de la app
+        manejador = self._MANEJADORES_ESTADO[sesion.estado]
+        if manejador is None:
+            return _MSG_FINALIZADO
+        return await manejador(self, sesion, mensaje)
 
     # --- mensajes y formateo (igual que los tuyos) ---
-    def _mensaje_bienvenida(self) -> str:
-        return (
-            "¡Hola! 👋 Bienvenido a Yo Soy Bienestar.\n\n"
-            "Por favor comparte tu número telefónico para verificar que eres cliente Yo Soy Bienestar."
-        )
-
-    def _mensaje_timeout(self) -> str:
-        return (
-            "❌ ⏱️ La verificación está tomando más tiempo de lo esperado. "
-            "Por favor intenta nuevamente más tarde."
-        )
-
-    def _mensaje_verificacion_exitosa(self) -> str:
-        return f"""✅ ¡Verificación exitosa! 
-
-Hola bienvenido Cliente Yo Soy Bienestar.
-
-📱 Número: {self.datos_cliente.get('msisdn', 'N/A')}
-⚡ Servicio: {self.datos_cliente.get('altanService', 'N/A')}
-🟢 Estado: {self.datos_cliente.get('altanStatus', 'N/A')}
-
-¿Qué operación deseas realizar?
-
-1️⃣ Reportar problema con recarga
-2️⃣ Realizar otro tipo de reporte  
-3️⃣ Salir del chat
-
-Por favor selecciona una opción (1, 2 o 3):"""
-
-    def _manejar_opcion_recarga(self) -> str:
-        self.estado = self.ESTADOS["SOLICITAR_REFERENCIA"]
-        return (
-            "📋 Reportar Problema con Recarga\n\n"
-            "Por favor ingresa el número de referencia de tu recarga:"
-        )
-
-    def _manejar_opcion_otro_reporte(self) -> str:
-        self.estado = self.ESTADOS["FINALIZADO"]
-        return (
-            "ℹ️ Realizar otro tipo de reporte\n\n"
-            "Esta funcionalidad actualmente no está desarrollada ni implementada.\n\n"
-            "Gracias por contactarnos. 👋"
-        )
-
-    def _manejar_opcion_salir(self) -> str:
-        self.estado = self.ESTADOS["FINALIZADO"]
-        return "👋 ¡Gracias por usar nuestro servicio! Que tengas un excelente día."
-
-    def _manejar_opcion_invalida(self) -> str:
-        return (
-            "⚠️ Opción no válida. Por favor selecciona:\n\n"
-            "1️⃣ Reportar problema con recarga\n"
-            "2️⃣ Realizar otro tipo de reporte\n"  
-            "3️⃣ Salir del chat\n\n"
-            "Escribe 1, 2 o 3:"
-        )
-
-    def _mensaje_timeout_recarga(self) -> str:
-        return (
-            "❌ ⏱️ La verificación de la recarga está tomando más tiempo de lo esperado. "
-            "Por favor intenta nuevamente más tarde o contacta a soporte."
-        )
+    def _mensaje_verificacion_exitosa(self, datos_cliente: Dict) -> str:
+        return _PLANTILLA_VERIFICACION.format_map(_ConDefecto(datos_cliente))
 
     def _formatear_informacion_recarga(self, datos_recarga: Dict, referencia: str) -> str:
-        data = datos_recarga.get("data", {})
-        referencia_real = data.get("paymentMethod", {}).get("reference", referencia)
-        nombre_cliente = f"{data.get('customer', {}).get('name', 'N/A')} {data.get('customer', {}).get('lastName', '')}"
-        telefono = data.get("customer", {}).get("phoneNumber", "N/A")
-        monto = data.get("amount", "N/A")
+        data = datos_recarga.get("data") or _VACIO
+        customer = data.get("customer") or _VACIO
+        payment = data.get("paymentMethod") or _VACIO
         estado = data.get("status", "N/A")
-        autorizacion = data.get("authorization", "N/A")
-        fecha_creacion = self._formatear_fecha(data.get("creationDate"))
-        fecha_operacion = self._formatear_fecha(data.get("operationDate"))
-        fecha_vencimiento = self._formatear_fecha(data.get("dueDate"))
-        emoji_estado = "✅" if estado == "completed" else "⏳" if estado == "pending" else "❌"
-        estado_formateado = self._traducir_estado(estado)
-
-        return f"""✅ **Información de Recarga Encontrada**
-
-📊 **Referencia:** {referencia_real}
-👤 **Cliente:** {nombre_cliente.strip()}
-📱 **Teléfono:** {telefono}
-💰 **Monto:** ${monto} MXN
-{emoji_estado} **Estado:** {estado_formateado}
-🔢 **Autorización:** {autorizacion}
-
-📅 **Fechas:**
-   • Creación: {fecha_creacion}
-   • Operación: {fecha_operacion}
-   • Vencimiento: {fecha_vencimiento}
+        emoji_estado, estado_formateado = _ESTADOS_RECARGA.get(estado, ("❌", estado))
+        fecha_creacion, fecha_operacion, fecha_vencimiento = map(
+            self._formatear_fecha, map(data.get, _CAMPOS_FECHA)
+        )
 
-📋 **Descripción:** {datos_recarga.get('message', 'Recarga Telefonia Celular - Yo Soy Bienestar')}
-
-¡Gracias por ser parte de Yo Soy Bienestar! 👋"""
+        return _PLANTILLA_RECARGA.format_map({
+            "referencia": payment.get("reference", referencia),
+            "cliente": f"{customer.get('name', 'N/A')} {customer.get('lastName', '')}".strip(),
+            "telefono": customer.get("phoneNumber", "N/A"),
+            "monto": data.get("amount", "N/A"),
+            "emoji_estado": emoji_estado,
+            "estado": estado_formateado,
+            "autorizacion": data.get("authorization", "N/A"),
+            "fecha_creacion": fecha_creacion,
+            "fecha_operacion": fecha_operacion,
+            "fecha_vencimiento": fecha_vencimiento,
+            "descripcion": datos_recarga.get("message", "Recarga Telefonia Celular - Yo Soy Bienestar"),
+        })
 
     def _formatear_fecha(self, fecha_str: str) -> str:
-        if not fecha_str:
-            return "N/A"
-        try:
-            if 'T' in fecha_str:
-                fecha_obj = datetime.fromisoformat(fecha_str.replace('Z', '+00:00'))
-            else:
-                fecha_obj = datetime.strptime(fecha_str, '%Y-%m-%d %H:%M:%S')
-            return fecha_obj.strftime('%d/%m/%Y %H:%M:%S')
-        except (ValueError, TypeError):
+        if not fecha_str or not isinstance(fecha_str, str):
             return "N/A"
-
-    def _traducir_estado(self, estado: str) -> str:
-        traducciones = {
-            "completed": "Completado",
-            "pending": "Pendiente",
-            "failed": "Fallido",
-            "cancelled": "Cancelado",
-            "in_progress": "En Progreso"
-        }
-        return traducciones.get(estado, estado)
+        return _formatear_fecha_iso(fecha_str)
 
     def _mensaje_referencia_no_encontrada(self, referencia: str) -> str:
         return f"""❌ **Referencia No Encontrada**
@@ -258,3 +531,12 @@ Te recomendamos:
 3. Contactar a nuestro equipo de soporte si el problema persiste
 
 ¡Gracias por contactarnos! 👋"""
+
+
+# Despachador compartido por todas las sesiones; no guarda estado de conversación
+_despachador = ChatBienestar()
+
+
+async def procesar_mensaje(sesion: SesionChat, mensaje: str) -> str:
+    """Procesa un mensaje ya normalizado, actualizando la sesión en su lugar."""
+    return await _despachador.procesar_mensaje(sesion, mensaje)
@@ -0,0 +1,213 @@
+# sesiones.py
+"""
+Almacenamiento de sesiones de chat.
+
+Por defecto las sesiones viven en memoria del proceso. Si se define la
+variable de entorno REDIS_URL se guardan en Redis, que expira las sesiones
+por sí mismo y permite correr varios workers sin perderlas.
+"""
+
+import asyncio
+import logging
+import os
+import threading
+import time
+import weakref
+from collections import OrderedDict, deque
+from typing import Dict, List, Optional, Tuple
+
+import ormsgpack
+import redis.asyncio as redis
+
+from chat_bienestar import SesionChat
+
+SESSION_TIMEOUT_SECONDS = 20 * 60  # 20 minutos
+SESSION_SHARDS = 16
+MAX_SESSIONS = 10_000
+REDIS_URL = os.environ.get("REDIS_URL")
+
+logger = logging.getLogger(__name__)
+
+# Instancias de SesionChat recicladas de sesiones expiradas en memoria
+_sesion_pool: deque = deque(maxlen=256)
+
+
+def _nueva_sesion() -> SesionChat:
+    """Toma una sesión reiniciada del pool o crea una nueva si está vacío."""
+    try:
+        sesion = _sesion_pool.popleft()
+    except IndexError:
+        return SesionChat()
+    sesion.reset()
+    return sesion
+
+
+class SesionesMemoria:
+    """
+    Sesiones en memoria, repartidas en shards con su propio lock para que
+    peticiones de sesiones distintas no compitan por un único mutex.
+    Cada shard es un OrderedDict en orden LRU: la sesión menos reciente va al frente.
+    Cada entrada lleva además un asyncio.Lock que serializa los mensajes de esa sesión.
+    """
+
+    def __init__(self) -> None:
+        self.shards: List[Tuple[threading.Lock, OrderedDict]] = [
+            (threading.Lock(), OrderedDict()) for _ in range(SESSION_SHARDS)
+        ]
+        self.max_por_shard = MAX_SESSIONS // SESSION_SHARDS
+
+    def _shard(self, sid: str) -> Tuple[threading.Lock, OrderedDict]:
+        """Devuelve el (lock, dict) que guarda la sesión indicada."""
+        return self.shards[hash(sid) % SESSION_SHARDS]
+
+    async def crear(self, sid: str) -> SesionChat:
+        sesion = _nueva_sesion()
+        shard_lock, shard = self._shard(sid)
+        with shard_lock:
+            shard[sid] = {
+                "sesion": sesion,
+                "candado": asyncio.Lock(),
+                "last_active": time.time()
+            }
+            while len(shard) > self.max_por_shard:
+                evicted, _ = shard.popitem(last=False)
+                logger.info("Sesión desalojada por capacidad: %s", evicted)
+        return sesion
+
+    async def obtener(self, sid: str) -> Optional[SesionChat]:
+        """Devuelve el estado de la sesión y la marca como la más reciente."""
+        shard_lock, shard = self._shard(sid)
+        with shard_lock:
+            session = shard.get(sid)
+            if not session:
+                return None
+            session["last_active"] = time.time()
+            shard.move_to_end(sid)
+            return session["sesion"]
+
+    async def guardar(self, sid: str, sesion: SesionChat) -> None:
+        """En memoria se modifica el mismo objeto de la sesión; no hay nada que escribir."""
+
+    def candado(self, sid: str) -> asyncio.Lock:
+        """Lock de la sesión; si no existe se devuelve uno nuevo, que no protege nada compartido."""
+        shard_lock, shard = self._shard(sid)
+        with shard_lock:
+            session = shard.get(sid)
+        return session["candado"] if session else asyncio.Lock()
+
+    async def eliminar(self, sid: str) -> bool:
+        # No se recicla: puede haber una petición en curso usando la sesión
+        shard_lock, shard = self._shard(sid)
+        with shard_lock:
+            return shard.pop(sid, None) is not None
+
+    async def contar(self) -> int:
+        # len() de un dict es atómico bajo el GIL; no hace falta tomar los locks
+        return sum(len(shard) for _, shard in self.shards)
+
+    async def describir(self) -> Dict[str, Dict]:
+        # Se copia cada shard bajo su lock y se arma la respuesta ya liberado;
+        # la vista puede ser ligeramente inconsistente, suficiente para debugging
+        snapshot = []
+        for shard_lock, shard in self.shards:
+            with shard_lock:
+                snapshot.extend(shard.items())
+        return {
+            sid: {
+                "last_active": data["last_active"],
+                "estado_actual": data["sesion"].nombre_estado,
+                "numero_verificado": data["sesion"].numero_verificado
+            }
+            for sid, data in snapshot
+        }
+
+    def purgar(self) -> None:
+        """
+        Elimina sesiones inactivas desde el frente LRU de cada shard y recicla
+        sus objetos. Sólo se reciclan las expiradas: una sesión desalojada por
+        capacidad puede tener todavía una petición en curso modificándola.
+        """
+        now = time.time()
+        for shard_lock, shard in self.shards:
+            with shard_lock:
+                while shard:
+                    sid, v = next(iter(shard.items()))
+                    if now - v["last_active"] <= SESSION_TIMEOUT_SECONDS:
+                        break
+                    shard.popitem(last=False)
+                    _sesion_pool.append(v["sesion"])
+                    logger.info("Sesión expirada eliminada: %s", sid)
+
+    async def cerrar(self) -> None:
+        pass
+
+
+class SesionesRedis:
+    """
+    Sesiones en Redis, una clave por sesión (sesion:{sid}) con el estado
+    empaquetado en msgpack. La expiración la hace Redis con el TTL de la
+    clave, renovado en cada mensaje.
+    """
+
+    PREFIJO = "sesion:"
+
+    def __init__(self, url: str) -> None:
+        # from_url crea un pool de conexiones compartido por todas las peticiones
+        self.redis = redis.from_url(url)
+        # Locks por sesión dentro de este proceso; desaparecen cuando nadie los usa
+        self._candados: weakref.WeakValueDictionary = weakref.WeakValueDictionary()
+
+    async def crear(self, sid: str) -> SesionChat:
+        sesion = SesionChat()
+        await self.guardar(sid, sesion)
+        return sesion
+
+    async def obtener(self, sid: str) -> Optional[SesionChat]:
+        datos = await self.redis.get(self.PREFIJO + sid)
+        return SesionChat.restore(ormsgpack.unpackb(datos)) if datos else None
+
+    async def guardar(self, sid: str, sesion: SesionChat) -> None:
+        datos = ormsgpack.packb({**sesion.dump(), "last_active": time.time()})
+        await self.redis.set(self.PREFIJO + sid, datos, ex=SESSION_TIMEOUT_SECONDS)
+
+    def candado(self, sid: str) -> asyncio.Lock:
+        # Sólo serializa mensajes que llegan al mismo worker
+        candado = self._candados.get(sid)
+        if candado is None:
+            candado = self._candados[sid] = asyncio.Lock()
+        return candado
+
+    async def eliminar(self, sid: str) -> bool:
+        return await self.redis.delete(self.PREFIJO + sid) > 0
+
+    async def contar(self) -> Optional[int]:
+        # Contar exigiría un SCAN de todas las claves sesion:*; /health no lo paga en cada sondeo
+        return None
+
+    async def describir(self) -> Dict[str, Dict]:
+        session_info = {}
+        async for clave in self.redis.scan_iter(match=self.PREFIJO + "*", count=1000):
+            datos = await self.redis.get(clave)
+            if not datos:
+                continue
+            datos = ormsgpack.unpackb(datos)
+            sesion = SesionChat.restore(datos)
+            session_info[clave.decode()[len(self.PREFIJO):]] = {
+                "last_active": datos.get("last_active", 0),
+                "estado_actual": sesion.nombre_estado,
+                "numero_verificado": sesion.numero_verificado
+            }
+        return session_info
+
+    def purgar(self) -> None:
+        """Redis expira las sesiones por TTL; no hay nada que purgar."""
+
+    async def cerrar(self) -> None:
+        await self.redis.aclose()
+
+
+def crear_almacen():
+    """Elige Redis si REDIS_URL está definida; si no, memoria del proceso."""
+    if REDIS_URL:
+        return SesionesRedis(REDIS_URL)
+    return SesionesMemoria()
@@ -0,0 +1,191 @@
+# tests/test_api.py
+import asyncio
+from types import SimpleNamespace
+
+import httpx
+import pytest
+
+import chat_bienestar as cb
+
+
+class Reloj:
+    """Sustituye a time.monotonic dentro de chat_bienestar; avanza sólo a mano."""
+
+    def __init__(self) -> None:
+        self.ahora = 1000.0
+
+    def monotonic(self) -> float:
+        return self.ahora
+
+
+@pytest.fixture
+def api(monkeypatch):
+    """Estado de módulo limpio y una API falsa cuyas respuestas define cada test."""
+    reloj = Reloj()
+    monkeypatch.setattr(cb, "time", SimpleNamespace(monotonic=reloj.monotonic))
+    monkeypatch.setattr(cb, "_cache_api", cb._CacheTTL(maxsize=16, ttl=60))
+    monkeypatch.setattr(cb, "_circuito_api", cb._CircuitoAPI(ventana=20, umbral=0.5, pausa=10.0))
+    monkeypatch.setattr(cb, "_peticiones_en_curso", {})
+    monkeypatch.setattr(cb, "BACKOFF_BASE", 0)
+
+    fake = SimpleNamespace(llamadas=[], responder=None, reloj=reloj)
+
+    async def transporte(request: httpx.Request) -> httpx.Response:
+        fake.llamadas.append(str(request.url))
+        return await fake.responder(request)
+
+    async def correr(corutina_factory):
+        monkeypatch.setattr(cb, "_SEMAFORO_API", asyncio.Semaphore(cb.MAX_CONSULTAS_SIMULTANEAS))
+        monkeypatch.setattr(cb, "_cliente_http", httpx.AsyncClient(transport=httpx.MockTransport(transporte)))
+        try:
+            return await corutina_factory()
+        finally:
+            await cb._cliente_http.aclose()
+
+    fake.correr = lambda f: asyncio.run(correr(f))
+    return fake
+
+
+def _ok(datos):
+    async def responder(request):
+        return httpx.Response(200, json=datos)
+    return responder
+
+
+def test_circuito_abre_con_mas_de_la_mitad_de_fallos(api):
+    chat = cb.ChatBienestar()
+    codigos = iter([200] * 10 + [500] * 10)
+
+    async def responder(request):
+        return httpx.Response(next(codigos, 500), json={"ok": 1})
+    api.responder = responder
+
+    async def escenario():
+        for i in range(20):
+            await chat._realizar_peticion_api(f"https://api/{i}")
+        # 10 de 20 fallos no supera el umbral
+        assert cb._circuito_api.permite()
+        await chat._realizar_peticion_api("https://api/20")
+        # 11 fallos en las últimas 20: se abre
+        assert not cb._circuito_api.permite()
+        return await chat._realizar_peticion_api("https://api/21")
+
+    assert api.correr(escenario) == "timeout"
+    assert len(api.llamadas) == 21  # con el circuito abierto no se llama a la API
+
+    api.reloj.ahora += 10
+    assert cb._circuito_api.permite()
+
+
+def test_reintenta_una_sola_vez_si_falla_la_conexion(api):
+    async def responder(request):
+        raise httpx.ConnectError("rechazada", request=request)
+    api.responder = responder
+
+    resultado = api.correr(lambda: cb.ChatBienestar()._realizar_peticion_api("https://api/x"))
+    assert resultado is None
+    assert len(api.llamadas) == 2
+
+
+def test_timeout_no_se_reintenta(api):
+    async def responder(request):
+        raise httpx.ReadTimeout("lenta", request=request)
+    api.responder = responder
+
+    resultado = api.correr(lambda: cb.ChatBienestar()._realizar_peticion_api("https://api/x"))
+    assert resultado == "timeout"
+    assert len(api.llamadas) == 1
+
+
+def test_respuesta_vacia_se_cachea_cinco_segundos(api):
+    chat = cb.ChatBienestar()
+
+    async def responder(request):
+        return httpx.Response(404)
+    api.responder = responder
+
+    async def consultar():
+        return await chat.verificar_cliente_api("5512345678")
+
+    assert api.correr(consultar) == {}
+    api.reloj.ahora += 4.5
+    assert api.correr(consultar) == {}
+    assert len(api.llamadas) == 1
+
+    api.reloj.ahora += 1
+    assert api.correr(consultar) == {}
+    assert len(api.llamadas) == 2
+
+
+@pytest.mark.parametrize("responder", [
+    lambda request: httpx.Response(500),
+    lambda request: httpx.Response(200, content=b"<html>no es json"),
+], ids=["error_500", "json_invalido"])
+def test_error_de_la_api_no_se_cachea(api, responder):
+    chat = cb.ChatBienestar()
+
+    async def responder_async(request):
+        return responder(request)
+    api.responder = responder_async
+
+    async def consultar():
+        return await chat.verificar_cliente_api("5500000000")
+
+    assert api.correr(consultar) is None
+    assert api.correr(consultar) is None
+    assert len(api.llamadas) == 2
+    assert cb._cache_api.stats()["size"] == 0
+
+
+def test_respuesta_encontrada_se_cachea_con_ttl_normal(api):
+    chat = cb.ChatBienestar()
+    api.responder = _ok([{"name": "Ana"}])
+
+    async def consultar():
+        return await chat.verificar_cliente_api("5512345678")
+
+    assert api.correr(consultar) == [{"name": "Ana"}]
+    api.reloj.ahora += 6
+    assert api.correr(consultar) == [{"name": "Ana"}]
+    assert len(api.llamadas) == 1
+
+
+class CuerpoVigilado(httpx.AsyncByteStream):
+    """Cuerpo de respuesta que recuerda si alguien lo leyó."""
+
+    def __init__(self) -> None:
+        self.leido = False
+
+    async def __aiter__(self):
+        self.leido = True
+        yield b'{"error": "not found"}'
+
+
+@pytest.mark.parametrize("version, se_lee", [("HTTP/2", False), ("HTTP/1.1", True)])
+def test_cuerpo_de_error_solo_se_descarta_en_http2(api, version, se_lee):
+    cuerpo = CuerpoVigilado()
+
+    async def responder(request):
+        return httpx.Response(404, stream=cuerpo, extensions={"http_version": version.encode()})
+    api.responder = responder
+
+    resultado = api.correr(lambda: cb.ChatBienestar()._realizar_peticion_api("https://api/x"))
+    assert resultado == {}
+    assert cuerpo.leido is se_lee
+
+
+def test_consultas_simultaneas_iguales_hacen_una_llamada(api):
+    chat = cb.ChatBienestar()
+
+    async def responder(request):
+        await asyncio.sleep(0.01)
+        return httpx.Response(200, json={"code": 0})
+    api.responder = responder
+
+    async def escenario():
+        return await asyncio.gather(*(chat._realizar_peticion_api("https://api/igual") for _ in range(25)))
+
+    resultados = api.correr(escenario)
+    assert resultados == [{"code": 0}] * 25
+    assert len(api.llamadas) == 1
+    assert cb._peticiones_en_curso == {}
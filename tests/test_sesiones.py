@@ -0,0 +1,24 @@
+# tests/test_sesiones.py
+import asyncio
+
+import sesiones
+from chat_bienestar import Estado
+
+
+def test_crear_reutiliza_sesion_expirada_reiniciada():
+    sesiones._sesion_pool.clear()
+    almacen = sesiones.SesionesMemoria()
+    vieja = asyncio.run(almacen.crear("vieja"))
+    vieja.estado = Estado.MENU_PRINCIPAL
+    vieja.numero_verificado = "5512345678"
+    vieja.datos_cliente = {"name": "Ana"}
+    _, shard = almacen._shard("vieja")
+    shard["vieja"]["last_active"] -= sesiones.SESSION_TIMEOUT_SECONDS + 1
+
+    almacen.purgar()
+    nueva = asyncio.run(almacen.crear("nueva"))
+
+    assert nueva is vieja  # sale del pool de sesiones recicladas
+    assert nueva.estado is Estado.INICIO
+    assert nueva.numero_verificado is None
+    assert nueva.datos_cliente is None